@@ -1,9 +1,13 @@
 from pathlib import Path
 from typing import Optional
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).parent
 
+# Entries smaller than this are dropped rather than truncated into the prompt context
+MIN_ENTRY_TOKENS = 32
+
 
 class EnvSettings(BaseSettings):
     GOOGLE_API_KEY: str = ""
@@ -15,6 +19,16 @@ class EnvSettings(BaseSettings):
 
     TOP_K: int = 5
 
+    CONTEXT_MAX_TOKENS: int = Field(4000, ge=MIN_ENTRY_TOKENS)
+
+    # The embeddings API accepts at most 100 texts per batch request
+    EMBED_BATCH_SIZE: int = Field(100, ge=1, le=100)
+    BATCH_CONCURRENCY: int = Field(8, ge=1)
+
+    RERANK_ENABLED: bool = False
+    RERANK_OVERFETCH: int = Field(4, ge=1)
+    RERANK_BUDGET_MS: float = Field(50, gt=0)
+
     model_config = SettingsConfigDict(
         env_file=BASE_DIR / '.env',
         env_file_encoding='utf-8',
@@ -1,6 +1,8 @@
 from fastapi import APIRouter
-from schemas.query import QueryRequest
+from fastapi.responses import StreamingResponse
+from schemas.query import QueryRequest, BatchQueryRequest
 from utils.rag_service import get_rag_result
+from utils.batch_service import iter_ndjson
 from utils.ask import get_ask_result
 
 
@@ -11,6 +13,13 @@ def query_labor_law(request: QueryRequest):
     result = get_rag_result(request.question, top_k=request.top_k)
     return {"response": result}
 
+@router.post("/rag/batch")
+def query_labor_law_batch(request: BatchQueryRequest):
+    return StreamingResponse(
+        iter_ndjson(request.questions, top_k=request.top_k),
+        media_type="application/x-ndjson",
+    )
+
 @router.post("/ask")
 def ask_question(question: str):
     result = get_ask_result(question)
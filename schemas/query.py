@@ -1,10 +1,14 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, StringConstraints
+from typing import Optional, List, Dict, Any, Annotated
 
 class QueryRequest(BaseModel):
     question: str
     top_k: Optional[int] = Field(5, ge=1, le=10, description="要檢索的文件數量。")
 
+class BatchQueryRequest(BaseModel):
+    questions: List[Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]] = Field(min_length=1, max_length=1000, description="要查詢的問題列表，單次最多 1000 題。")
+    top_k: Optional[int] = Field(5, ge=1, le=10, description="每個問題要檢索的文件數量。")
+
 class Answer(BaseModel):
     answer: str = Field(description="問題的答案。")
     hit_references: List[Dict[str, Any]] = Field(description="生成答案所引用的相關參考資料。")
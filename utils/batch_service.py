@@ -0,0 +1,99 @@
+import argparse
+import json
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from typing import List, Dict, Any, Iterator, Tuple
+
+from . import embeddings, env_settings
+from .rag_service import get_rag_result
+
+
+def _drain(futures: Dict[Future, Tuple[int, str]], block: bool) -> Iterator[Dict[str, Any]]:
+    """
+    回傳已完成的查詢結果並自 futures 中移除；block 為 True 時等待全部完成。
+    """
+    done = as_completed(list(futures)) if block else [f for f in list(futures) if f.done()]
+    for future in done:
+        index, question = futures.pop(future)
+        try:
+            yield {"index": index, "question": question, "response": future.result()}
+        except Exception as e:
+            yield {"index": index, "question": question, "error": str(e)}
+
+
+def run_batch(questions: List[str], top_k: int = 5) -> Iterator[Dict[str, Any]]:
+    """
+    批次執行 RAG 查詢，依完成順序逐筆回傳結果。
+
+    向量以 EMBED_BATCH_SIZE 為單位、每個 chunk 一次 embeddings 呼叫批次產生，各問題的檢索與生成以最多
+    BATCH_CONCURRENCY 個執行緒並行，法條編號查詢結果在同一批次內共用。
+    """
+    article_cache: Dict[str, List[Dict[str, Any]]] = {}
+    executor = ThreadPoolExecutor(max_workers=env_settings.BATCH_CONCURRENCY)
+    futures: Dict[Future, Tuple[int, str]] = {}
+
+    try:
+        for start in range(0, len(questions), env_settings.EMBED_BATCH_SIZE):
+            chunk = questions[start:start + env_settings.EMBED_BATCH_SIZE]
+            try:
+                vectors = embeddings.embed_documents(
+                    chunk, batch_size=len(chunk), task_type="RETRIEVAL_QUERY"
+                )
+            except Exception as e:
+                # 批次 embedding 失敗時改由 retrieve_documents 逐題產生向量
+                print(f"Batch embedding failed, embedding questions individually: {e}")
+                vectors = [None] * len(chunk)
+
+            for offset, (question, vector) in enumerate(zip(chunk, vectors)):
+                future = executor.submit(
+                    get_rag_result, question, top_k,
+                    query_embedding=vector, article_cache=article_cache
+                )
+                futures[future] = (start + offset, question)
+
+            # 在處理下一個 chunk 前先送出已完成的結果，讓串流盡早開始
+            yield from _drain(futures, block=False)
+
+        yield from _drain(futures, block=True)
+    finally:
+        # 用戶端中斷或發生錯誤時，取消尚未開始的查詢而不等待其完成
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_ndjson(questions: List[str], top_k: int = 5) -> Iterator[str]:
+    """
+    將 run_batch 的結果轉為 NDJSON 行。
+    """
+    for item in run_batch(questions, top_k=top_k):
+        yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次執行 RAG 查詢，輸出 NDJSON。")
+    parser.add_argument("input", help="問題檔案，每行一個問題；使用 - 代表標準輸入。")
+    parser.add_argument("-o", "--output", help="輸出檔案，預設為標準輸出。")
+    parser.add_argument("--top-k", type=int, default=env_settings.TOP_K, help="要檢索的文件數量。")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    questions = [line.strip() for line in lines if line.strip()]
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        # RAG 流程的進度訊息改輸出至 stderr，避免混入 NDJSON
+        with redirect_stdout(sys.stderr):
+            for line in iter_ndjson(questions, top_k=args.top_k):
+                out.write(line)
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import tiktoken
+
+from env_settings import MIN_ENTRY_TOKENS
+
+# tiktoken 的編碼與 Gemini 的 tokenizer 並不相同，這裡僅作為本地的 token 數估算
+TOKENIZER_ENCODING = "cl100k_base"
+
+# 有法條內容時保留給 db_articles 的最低 token 比例，避免被參考資料全數擠掉
+DB_ARTICLE_BUDGET_RATIO = 0.3
+
+# 編碼檔載入失敗後，間隔此秒數才重新嘗試
+TOKENIZER_RETRY_SECONDS = 60
+
+_encoding = None
+_encoding_failed_at = None
+
+
+def _get_encoding():
+    """
+    取得 tiktoken 編碼，只快取成功載入的結果；失敗時暫時改用字元數估算並於稍後重試。
+    """
+    global _encoding, _encoding_failed_at
+    if _encoding is not None:
+        return _encoding
+    if _encoding_failed_at is not None and time.monotonic() - _encoding_failed_at < TOKENIZER_RETRY_SECONDS:
+        return None
+    try:
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        _encoding_failed_at = None
+    except Exception as e:
+        # 離線環境可能無法下載編碼檔，改用字元數估算
+        print(f"Tokenizer unavailable, falling back to character estimate: {e}")
+        _encoding_failed_at = time.monotonic()
+    return _encoding
+
+
+# 於啟動時載入編碼，避免第一個請求才下載編碼檔
+_get_encoding()
+
+
+def count_tokens(text: str) -> int:
+    """
+    以本地 tokenizer 估算文字的 token 數。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    將文字截斷至指定的 token 數以內。
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 中文字可能被拆成多個 byte token，忽略截斷處不完整的字元以免產生亂碼
+    return encoding.decode_bytes(tokens[:max_tokens]).decode("utf-8", errors="ignore")
+
+
+def article_key(doc: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    取得文件的唯一識別鍵：法條以條號識別，QA 以問題識別。
+    """
+    metadata = doc.get("metadata") or {}
+    source = metadata.get("source", "")
+    if source == "labor_law" and metadata.get("article"):
+        return source, str(metadata["article"])
+    return source, doc["page_content"]
+
+
+def dedupe_documents(docs: List[Dict[str, Any]],
+                     seen: Optional[set] = None) -> List[Dict[str, Any]]:
+    """
+    依 article_key 去除重複文件，保留第一次出現者。
+    傳入 seen 時會沿用並更新該集合，用於跨來源去重。
+    """
+    if seen is None:
+        seen = set()
+    unique_docs = []
+    for doc in docs:
+        key = article_key(doc)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_docs.append(doc)
+    return unique_docs
+
+
+def ref_id(doc: Dict[str, Any], index: int) -> str:
+    """
+    產生提示中使用的精簡參考編號，例如 "第17條" 或 "QA-3"。
+    """
+    metadata = doc.get("metadata") or {}
+    if metadata.get("source") == "labor_law" and metadata.get("article"):
+        return f"第{metadata['article']}條"
+    return f"QA-{index}"
+
+
+def format_entry(doc: Dict[str, Any], ref: str) -> str:
+    """
+    將單一文件格式化為精簡的提示片段。
+    QA 文件的答案僅出現一次，不再重複輸出完整的 metadata。
+    """
+    metadata = doc.get("metadata") or {}
+    tag = f"[{ref}"
+    chapter = metadata.get("chapter")
+    if chapter and len(chapter) > 1 and chapter[1]:
+        tag += f" | {chapter[1]}"
+    references = metadata.get("references")
+    if references:
+        tag += f" | 參照: {', '.join(references)}"
+    tag += "]"
+
+    if metadata.get("source") == "labor_law_qa":
+        body = f"Q: {doc['page_content']}\nA: {metadata.get('answer', '')}"
+    else:
+        body = doc["page_content"]
+    return f"{tag}\n{body}"
+
+
+def build_context(documents: List[Dict[str, Any]],
+                  db_articles: List[Dict[str, Any]],
+                  max_tokens: int) -> Dict[str, Any]:
+    """
+    建立送入 LLM 的參考資料與法條內容。
+
+    依 article_key 去重（同時出現在 documents 與 db_articles 的法條只保留於 documents），
+    documents 依分數排序後優先放入（有 rerank_score 時以其為準，否則使用向量分數），
+    但有 db_articles 時 documents 最多只能使用 (1 - DB_ARTICLE_BUDGET_RATIO) 的額度，
+    db_articles 可使用保留額度及 documents 未用完的部分。超出額度的文件會被截斷或捨棄。
+    回傳 context 文字、實際放入的文件（以 ref 為鍵）與 token 統計。
+    """
+    seen = set()
+    ranked_docs = sorted(
+        documents, key=lambda d: d.get("rerank_score", d.get("score", 0)), reverse=True
+    )
+    unique_docs = dedupe_documents(ranked_docs, seen)
+    unique_articles = dedupe_documents(db_articles, seen)
+
+    sections = {"documents": [], "db_articles": []}
+    refs = {}
+    used_tokens = 0
+    dropped = {"documents": 0, "db_articles": 0}
+    truncated = 0
+    qa_index = 0
+    separator_tokens = count_tokens("\n\n")
+
+    reserved = int(max_tokens * DB_ARTICLE_BUDGET_RATIO) if unique_articles else 0
+    limits = {"documents": max_tokens - reserved, "db_articles": max_tokens}
+
+    for section, docs in (("documents", unique_docs), ("db_articles", unique_articles)):
+        for doc in docs:
+            ref = ref_id(doc, qa_index + 1)
+            if ref.startswith("QA-"):
+                qa_index += 1
+            entry = format_entry(doc, ref)
+            remaining = limits[section] - used_tokens - separator_tokens
+            entry_tokens = count_tokens(entry)
+            if entry_tokens > remaining:
+                if remaining < MIN_ENTRY_TOKENS:
+                    dropped[section] += 1
+                    continue
+                entry = truncate_to_tokens(entry, remaining)
+                truncated += 1
+                entry_tokens = count_tokens(entry)
+            sections[section].append(entry)
+            refs[ref] = doc
+            used_tokens += entry_tokens + separator_tokens
+
+    stats = {
+        "input_documents": len(documents) + len(db_articles),
+        "unique_documents": len(unique_docs) + len(unique_articles),
+        "included_documents": len(refs),
+        "truncated_documents": truncated,
+        "dropped_documents": dropped["documents"] + dropped["db_articles"],
+        "dropped_db_articles": dropped["db_articles"],
+        "context_tokens": used_tokens,
+        "max_context_tokens": max_tokens,
+    }
+    return {
+        "documents": "\n\n".join(sections["documents"]),
+        "db_articles": "\n\n".join(sections["db_articles"]),
+        "refs": refs,
+        "stats": stats,
+    }
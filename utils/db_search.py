@@ -2,7 +2,7 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 from env_settings import EnvSettings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 
 def get_db_connection():
@@ -59,12 +59,18 @@ def search_articles_by_numbers(article_numbers: List[str]) -> List[Dict[str, Any
     """
     Searches for articles in the database where metadata references match the given article numbers.
     """
+    return _fetch_articles_by_numbers(article_numbers) or []
+
+def _fetch_articles_by_numbers(article_numbers: List[str]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Runs the article number search, returning None if the database could not be queried.
+    """
     if not article_numbers:
         return []
 
     conn = get_db_connection()
     if conn is None:
-        return []
+        return None
 
     results = []
     try:
@@ -100,8 +106,30 @@ def search_articles_by_numbers(article_numbers: List[str]) -> List[Dict[str, Any
 
     except psycopg2.Error as e:
         print(f"DB Error in search_articles_by_numbers: {e}")
+        results = None
     finally:
         if conn:
             conn.close()
             
     return results
+
+def search_articles_by_numbers_cached(article_numbers: List[str],
+                                      cache: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Same as search_articles_by_numbers, but reuses results stored in the given cache
+    (keyed by article number) and only queries the database for missing numbers.
+    Failed lookups are not cached, so later questions can retry them.
+    """
+    missing = [num for num in article_numbers if num not in cache]
+    fetched = _fetch_articles_by_numbers(missing) if missing else []
+    if fetched is not None:
+        for num in missing:
+            cache[num] = [
+                row for row in fetched
+                if num in (row["metadata"] or {}).get("references", [])
+            ]
+
+    results = []
+    for num in article_numbers:
+        results.extend(cache.get(num, []))
+    return results
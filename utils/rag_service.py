@@ -3,20 +3,25 @@ from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
 from langgraph.graph import StateGraph, END
-from typing import List, Dict, Any, TypedDict
+from typing import List, Dict, Any, Optional, TypedDict
 
-from . import llm, vector_store
+from . import llm, embeddings, vector_store, env_settings
 from schemas.query import Answer, ArticleExtraction
-from .db_search import search_articles, search_articles_by_numbers
+from .context_builder import build_context, count_tokens
+from .reranker import rerank
+from .db_search import search_articles, search_articles_by_numbers, search_articles_by_numbers_cached
 
 # Define the state for our graph
 class GraphState(TypedDict):
     question: str
     top_k: int
+    query_embedding: List[float]
+    article_cache: Dict[str, List[Dict[str, Any]]]
     documents: List[Dict[str, Any]]
     article_numbers: List[str]
     db_articles: List[Dict[str, Any]]
     final_answer: Dict[str, Any]
+    prompt_stats: Dict[str, Any]
 
 # LLM Parser for Answer
 llm_parser = JsonOutputParser(pydantic_object=Answer)
@@ -32,6 +37,7 @@ template = """你是一位回答問題的助手。請根據以下參考資料與
 ---
 問題: {question}
 ---
+hit_references 中的每筆資料需包含 ref 欄位，填入所引用參考資料標籤中的編號（例如 第17條、QA-1）。
 {format_instructions}
 """
 prompt = PromptTemplate.from_template(
@@ -47,7 +53,7 @@ extraction_parser = JsonOutputParser(pydantic_object=ArticleExtraction)
 
 # Prompt Template for Extraction
 extraction_template = """你是一位專業的法律助手。請根據以下參考資料與問題，判斷需要額外查詢哪些法條內容。
-請注意參考資料的 metadata 中可能包含 'references' 欄位，其中列出了相關法條編號。
+請注意參考資料標籤中可能包含「參照」欄位，其中列出了相關法條編號。
 請綜合問題需求與參考資料，列出所有需要查詢的法條編號（僅需數字）。
 
 ---
@@ -75,13 +81,19 @@ def retrieve_documents(state: GraphState) -> GraphState:
     print("--- Retrieving Documents ---")
     question = state["question"]
     top_k = state["top_k"]
+    # Over-retrieve so the rerank stage has candidates to choose from
+    if env_settings.RERANK_ENABLED:
+        top_k *= env_settings.RERANK_OVERFETCH
+
+    # Batch requests embed all questions up front; embed here only when missing
+    query_embedding = state.get("query_embedding") or embeddings.embed_query(question)
 
     # Retrieve documents from two different sources
-    law_docs_with_scores = vector_store.similarity_search_with_score(
-        question, k=top_k, filter={"source": "labor_law"}
+    law_docs_with_scores = vector_store.similarity_search_with_score_by_vector(
+        query_embedding, k=top_k, filter={"source": "labor_law"}
     )
-    qa_docs_with_scores = vector_store.similarity_search_with_score(
-        question, k=top_k, filter={"source": "labor_law_qa"}
+    qa_docs_with_scores = vector_store.similarity_search_with_score_by_vector(
+        query_embedding, k=top_k, filter={"source": "labor_law_qa"}
     )
 
     # Combine and format the documents
@@ -94,6 +106,21 @@ def retrieve_documents(state: GraphState) -> GraphState:
     print(f"Retrieved {len(state['documents'])} documents.")
     return state
 
+def rerank_documents(state: GraphState) -> GraphState:
+    """
+    Re-score the retrieved documents locally and keep only the best top_k.
+    """
+    if not env_settings.RERANK_ENABLED:
+        return state
+
+    print("--- Reranking Documents ---")
+    state["documents"] = rerank(
+        state["question"], state["documents"],
+        keep=state["top_k"], budget_ms=env_settings.RERANK_BUDGET_MS,
+    )
+    print(f"Kept {len(state['documents'])} documents after reranking.")
+    return state
+
 def extract_related_articles(state: GraphState) -> GraphState:
     """
     Extract related article numbers from documents and question.
@@ -103,15 +130,17 @@ def extract_related_articles(state: GraphState) -> GraphState:
     documents = state["documents"]
     
     # Prepare context for extraction
-    doc_context = "\n\n".join(
-        f"Metadata: {doc['metadata']}\nContent: {doc['page_content']}" for doc in documents
-    )
+    context = build_context(documents, [], env_settings.CONTEXT_MAX_TOKENS)
+    extraction_inputs = {
+        "documents": context["documents"],
+        "question": question
+    }
+    state["prompt_stats"] = {
+        "extraction_prompt_tokens": count_tokens(extraction_prompt.format(**extraction_inputs)),
+    }
     
     try:
-        result = extraction_chain.invoke({
-            "documents": doc_context,
-            "question": question
-        })
+        result = extraction_chain.invoke(extraction_inputs)
         article_numbers = result.get("article_numbers", [])
     except Exception as e:
         print(f"Error extracting articles: {e}")
@@ -132,8 +161,12 @@ def search_articles_in_db(state: GraphState) -> GraphState:
     # Keyword search
     keyword_articles = search_articles(question)
     
-    # Number search
-    number_articles = search_articles_by_numbers(article_numbers)
+    # Number search, shared across questions when an article cache is provided
+    article_cache = state.get("article_cache")
+    if article_cache is not None:
+        number_articles = search_articles_by_numbers_cached(article_numbers, article_cache)
+    else:
+        number_articles = search_articles_by_numbers(article_numbers)
     
     # Combine and deduplicate
     all_articles = keyword_articles + number_articles
@@ -159,18 +192,20 @@ def generate_answer(state: GraphState) -> GraphState:
     db_articles = state["db_articles"]
 
     # Format the context for the LLM
-    doc_context = "\n\n".join(
-        f"Source: {doc['metadata']}\nContent: {doc['page_content']}" for doc in documents
-    )
-    article_context = "\n\n".join(
-        f"Source: {art['metadata']}\nContent: {art['page_content']}" for art in db_articles
+    context = build_context(documents, db_articles, env_settings.CONTEXT_MAX_TOKENS)
+    prompt_inputs = {
+        "documents": context["documents"],
+        "db_articles": context["db_articles"],
+        "question": question,
+    }
+    prompt_stats = {**context["stats"], **(state.get("prompt_stats") or {})}
+    prompt_stats["answer_prompt_tokens"] = count_tokens(prompt.format(**prompt_inputs))
+    prompt_stats["total_prompt_tokens"] = (
+        prompt_stats["answer_prompt_tokens"] + prompt_stats.get("extraction_prompt_tokens", 0)
     )
+    print(f"Prompt stats: {prompt_stats}")
 
-    llm_response = llm_chain.invoke({
-        "documents": doc_context,
-        "db_articles": article_context,
-        "question": question,
-    })
+    llm_response = llm_chain.invoke(prompt_inputs)
     
     print("--- LLM Response ---")
     print(llm_response)
@@ -184,6 +219,14 @@ def generate_answer(state: GraphState) -> GraphState:
     
     for hit in raw_hits:
         matched = False
+        # The LLM is asked to cite the compact ref tag from the context
+        hit_ref = hit.get("ref") if isinstance(hit, dict) else hit
+        if isinstance(hit_ref, str) and hit_ref in context["refs"]:
+            formatted_hit_references.append(context["refs"][hit_ref])
+            continue
+        if not isinstance(hit, dict):
+            formatted_hit_references.append({"ref": hit})
+            continue
         # Try to match the hit with one of the retrieved documents
         for ref in all_references:
             # Check if metadata matches. 
@@ -203,19 +246,23 @@ def generate_answer(state: GraphState) -> GraphState:
         "answer": llm_response["answer"],
         "hit_references": formatted_hit_references,
         "references": all_references,
+        "prompt_stats": prompt_stats,
     }
+    state["prompt_stats"] = prompt_stats
     return state
 
 # Define the graph
 workflow = StateGraph(GraphState)
 workflow.add_node("retrieve_documents", retrieve_documents)
+workflow.add_node("rerank_documents", rerank_documents)
 workflow.add_node("extract_related_articles", extract_related_articles)
 workflow.add_node("search_articles_in_db", search_articles_in_db)
 workflow.add_node("generate_answer", generate_answer)
 
 # Set the entry point and build the graph
 workflow.set_entry_point("retrieve_documents")
-workflow.add_edge("retrieve_documents", "extract_related_articles")
+workflow.add_edge("retrieve_documents", "rerank_documents")
+workflow.add_edge("rerank_documents", "extract_related_articles")
 workflow.add_edge("extract_related_articles", "search_articles_in_db")
 workflow.add_edge("search_articles_in_db", "generate_answer")
 workflow.add_edge("generate_answer", END)
@@ -223,7 +270,9 @@ workflow.add_edge("generate_answer", END)
 # Compile the graph
 app = workflow.compile() 
 
-def get_rag_result(question: str, top_k: int = 5) -> dict:
+def get_rag_result(question: str, top_k: int = 5,
+                   query_embedding: Optional[List[float]] = None,
+                   article_cache: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> dict:
     """
     Run the RAG graph to get the result.
     """
@@ -232,6 +281,10 @@ def get_rag_result(question: str, top_k: int = 5) -> dict:
         "question": question,
         "top_k": top_k,
     }
+    if query_embedding is not None:
+        inputs["query_embedding"] = query_embedding
+    if article_cache is not None:
+        inputs["article_cache"] = article_cache
     result = app.invoke(inputs)
     final_answer = result.get("final_answer", {})
     print("--- Final RAG Result ---")
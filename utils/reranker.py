@@ -0,0 +1,107 @@
+import re
+import time
+from collections import Counter
+from typing import List, Dict, Any
+
+import numpy as np
+
+# BM25 參數
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 最終分數中 BM25 分數所佔的比重，其餘為向量檢索的分數
+LEXICAL_WEIGHT = 0.5
+
+_token_pattern = re.compile(r'[一-鿿]+|[a-zA-Z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    將文字切為詞元：中文取單字與相鄰二字組合，英數字取整個單字。
+    """
+    tokens = []
+    for segment in _token_pattern.findall(text):
+        if segment.isascii():
+            tokens.append(segment.lower())
+            continue
+        tokens.extend(segment)
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+def document_text(doc: Dict[str, Any]) -> str:
+    """
+    取得文件用於評分的文字，QA 文件會一併納入答案內容。
+    """
+    metadata = doc.get("metadata") or {}
+    if metadata.get("source") == "labor_law_qa":
+        return f"{doc['page_content']}\n{metadata.get('answer', '')}"
+    return doc["page_content"]
+
+
+def min_max_normalize(scores: np.ndarray) -> np.ndarray:
+    """
+    將分數線性縮放至 [0, 1]；所有分數相同時回傳全零。
+    """
+    low, high = scores.min(), scores.max()
+    if high > low:
+        return (scores - low) / (high - low)
+    return np.zeros(len(scores))
+
+
+def bm25_scores(query_tokens: List[str], doc_tokens: List[List[str]]) -> np.ndarray:
+    """
+    以 NumPy 向量化計算每份文件對查詢的 BM25 分數。
+    """
+    terms = list(dict.fromkeys(query_tokens))
+    if not terms or not doc_tokens:
+        return np.zeros(len(doc_tokens))
+
+    term_index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(doc_tokens), len(terms)))
+    for row, tokens in enumerate(doc_tokens):
+        for term, count in Counter(tokens).items():
+            col = term_index.get(term)
+            if col is not None:
+                tf[row, col] = count
+
+    doc_len = np.array([len(tokens) for tokens in doc_tokens], dtype=float)
+    avg_len = doc_len.mean() or 1.0
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log(1 + (len(doc_tokens) - df + 0.5) / (df + 0.5))
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+    weighted = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    return weighted @ idf
+
+
+def rerank(question: str, documents: List[Dict[str, Any]], keep: int,
+           budget_ms: float) -> List[Dict[str, Any]]:
+    """
+    以 BM25 與向量分數（皆於候選文件間正規化）的加權結果重新排序文件，僅保留前 keep 筆。
+    斷詞階段超過 budget_ms 時放棄重新排序，直接依向量分數取前 keep 筆。
+    """
+    if not documents:
+        return []
+
+    start = time.perf_counter()
+
+    doc_tokens = []
+    for doc in documents:
+        doc_tokens.append(tokenize(document_text(doc)))
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            print(f"Rerank exceeded {budget_ms}ms budget, falling back to vector scores.")
+            return sorted(documents, key=lambda d: d.get("score", 0), reverse=True)[:keep]
+
+    lexical = min_max_normalize(bm25_scores(tokenize(question), doc_tokens))
+    vector = min_max_normalize(np.array([doc.get("score", 0) for doc in documents], dtype=float))
+    combined = LEXICAL_WEIGHT * lexical + (1 - LEXICAL_WEIGHT) * vector
+
+    # 評分已完成，即使超時也保留重新排序的結果，僅記錄耗時
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if elapsed_ms > budget_ms:
+        print(f"Rerank took {elapsed_ms:.1f}ms, over the {budget_ms}ms budget.")
+
+    order = np.argsort(-combined, kind="stable")[:keep]
+    print(f"Reranked {len(documents)} documents in {elapsed_ms:.1f}ms.")
+    return [{**documents[i], "rerank_score": float(combined[i])} for i in order]